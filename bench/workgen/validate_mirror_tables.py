@@ -37,7 +37,10 @@
 import os, re, sys
 from contextlib import redirect_stdout
 from wt_tools_common import wiredtiger_open
-from wt_cmp_uri import wiredtiger_compare_uri
+from wt_cmp_uri import compare_cursors, get_compare_cursor, get_dir_uri
+
+# Workgen stores the mirror configuration in the table's 'app_metadata'.
+_APP_META_RE = re.compile(r'app_metadata="([^"]*)"')
 
 # Print usage and exit with a failure status.
 def usage_exit():
@@ -46,84 +49,111 @@ def usage_exit():
     print('  database_dir is a POSIX pathname to a WiredTiger home directory')
     sys.exit(1)
 
-# Given a database directory, return all Workgen tables using the WiredTiger metadata file.
-def get_wiredtiger_db_files(connection):
+# Return the (key, value) pairs of all metadata entries starting with the given prefix, with the
+# prefix removed from the keys.
+def scan_metadata_prefix(c, prefix):
+
+    # If the search lands on the first matching entry, step back so the iteration below does not
+    # skip it.
+    c.set_key(prefix)
+    if c.search_near() > 0:
+        c.prev()
+
+    # Metadata cursors don't support range bounds, stop at the first key past the prefix range
+    # instead: every key between the prefix and its upper bound starts with the prefix.
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    entries = []
+    for k,v in c:
+        if k >= upper:
+            break
+        entries.append((k[len(prefix):], v))
+    return entries
+
+# Given a database directory, return all Workgen tables and the mirrored uri pairs among them
+# using a single pass over the WiredTiger metadata file.
+def scan_metadata(connection, db_dir):
 
     session = connection.open_session()
     c = session.open_cursor('metadata:', None, None)
 
-    prefix = 'file:'
-    c.set_key(prefix)
-    c.search_near()
-
-    files = []
-    for k,_ in c:
-        if not k.startswith(prefix):
-            break
-        if k.startswith(f'{prefix}WiredTiger'):
+    db_files = []
+    for name,_ in scan_metadata_prefix(c, 'file:'):
+        if name.startswith('WiredTiger'):
             continue
-        # Skip the prefix and remove the extension.
-        files.append(k[len(prefix):-3])
+        # Remove the extension.
+        db_files.append(name[:-3])
+
+    c.reset()
+    table_metadata = dict(scan_metadata_prefix(c, 'table:'))
 
     c.close()
     session.close()
-    return files
+    return db_files, get_mirrors(db_dir, db_files, table_metadata)
 
-# Given a list of database tables, return a list of mirrored uri pairs.
-def get_mirrors(connection, db_dir, db_files):
+# Given a list of database tables and their metadata, return a list of mirrored uri pairs.
+def get_mirrors(db_dir, db_files, table_metadata):
 
     db_files_remaining = set(db_files)
     mirrors = []
-    session = connection.open_session()
-    metadata_cursor = session.open_cursor('metadata:', None, None)
 
     for filename in db_files:
         if filename not in db_files_remaining:
             continue
-        db_files_remaining.remove(filename)
-        mirror_filename = get_mirror_file(metadata_cursor, f'table:{filename}')
+        db_files_remaining.discard(filename)
+
+        # It is possible that the file requested does not exist in the metadata file.
+        metadata = table_metadata.get(filename)
+        if metadata is None:
+            continue
+        mirror_filename = get_mirror_file(metadata)
 
         # At this point, there is no guarantee that the database contains all the base/mirror pairs.
         # It is possible to have a base and no associated mirror and vice-versa. This may happen
         # when a drop is occurring when a snapshot of the database is taken and fed into this
         # script.
         if mirror_filename and mirror_filename in db_files_remaining:
-            db_files_remaining.remove(mirror_filename)
+            db_files_remaining.discard(mirror_filename)
             mirrors.append([f'{db_dir}/table:{filename}',
                             f'{db_dir}/table:{mirror_filename}'])
 
-    metadata_cursor.close()
-    session.close()
     return mirrors
 
-# Get the mirror for the specified file by examining the file's metadata. Mirror names
-# are stored in the 'app_metadata' by Workgen when mirroring is enabled. If the file has
-# a mirror, the name of the mirror is returned. Otherwise, the function returns None.
-# It is possible that the requested file does not exist in the metadata file, return None in this
-# scenario as well.
-def get_mirror_file(metadata_cursor, filename):
-
-    # It is possible that the file requested does not exist in the metadata file.
-    try:
-       metadata = metadata_cursor[filename]
-    except Exception as e:
-        if e.__class__.__name__ == 'KeyError':
-            return None
-
-    result = re.findall('app_metadata="([^"]*)"', metadata)
+# Get the mirror for a table by examining the table's metadata. Mirror names are stored in
+# the 'app_metadata' by Workgen when mirroring is enabled. If the table has a mirror, the
+# name of the mirror is returned. Otherwise, the function returns None.
+def get_mirror_file(metadata):
+
+    # Most tables have no application metadata, skip the regular expression for those.
+    if 'app_metadata="' not in metadata:
+        return None
+    m = _APP_META_RE.search(metadata)
+    if not m:
+        return None
+
+    # Only the dynamic table flag and the mirror name are of interest, stop once both are found.
+    is_dynamic = False
     mirror = None
+    for element in m.group(1).split(','):
+        key, _, value = element.partition('=')
+        key = key.strip()
+        if key == 'workgen_dynamic_table':
+            is_dynamic = value.strip() == 'true'
+        elif key == 'workgen_table_mirror':
+            mirror = value.strip().split(':', 1)[1]
+        if is_dynamic and mirror:
+            break
 
-    if result:
-        app_metadata = dict((a.strip(), b.strip())
-            for a, b in (element.split('=')
-                for element in result[0].split(',')))
+    return mirror if is_dynamic else None
 
-        if app_metadata.get('workgen_dynamic_table') == 'true' and \
-           app_metadata.get('workgen_table_mirror') != None :
-            mirror = app_metadata['workgen_table_mirror']
-            mirror = mirror.split(':')[1]
+# Compare the tables of a mirrored uri pair using an existing connection to the database. Returns
+# zero if both tables contain the same data.
+def compare_mirror(connection, item):
 
-    return mirror
+    cc1, cc2 = [get_compare_cursor(connection, None, get_dir_uri(arg)[1], arg) for arg in item]
+    ecode = compare_cursors(cc1, cc2, False)
+    cc1.close()
+    cc2.close()
+    return ecode
 
 # ------------------------------------------------------------------------------
 
@@ -135,21 +165,24 @@ def main(sysargs):
     db_dir = sysargs[0]
 
     connection = wiredtiger_open(db_dir, 'readonly')
-    db_files = get_wiredtiger_db_files(connection)
-    mirrors = get_mirrors(connection, db_dir, db_files)
-    connection.close()
+    db_files, mirrors = scan_metadata(connection, db_dir)
     failure_count = 0
 
-    for item in mirrors:
-        stdout = None
-        try:
-            with open(os.devnull, "w") as f, redirect_stdout(f):
-                stdout = wiredtiger_compare_uri(item)
-        except SystemExit as e:
-            if e.code != 0:
-                print(f"Mirror mismatch {item}: {stdout}")
+    # Compare all the mirrors over the connection used to read the metadata. WiredTiger allows a
+    # single connection per database, so the comparisons cannot run in separate processes.
+    with open(os.devnull, "w") as devnull:
+        for item in mirrors:
+            try:
+                with redirect_stdout(devnull):
+                    ecode = compare_mirror(connection, item)
+            except SystemExit as e:
+                ecode = e.code
+            if ecode != 0:
+                print(f"Mirror mismatch {item}")
                 failure_count += 1
 
+    connection.close()
+
     if failure_count == 0:
         print(f"Successfully validated {len(mirrors)} table mirrors in " \
               f"database directory '{db_dir}'.")